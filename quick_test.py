@@ -15,6 +15,9 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Environment variables the RAG system needs before it can start
+REQUIRED_ENV_VARS = ("OPENAI_API_KEY", "SUPABASE_URL", "SUPABASE_KEY")
+
 
 def test_rag_system():
     """Run a quick test of the RAG system"""
@@ -22,8 +25,7 @@ def test_rag_system():
     print("🧪 RAG System Quick Test\n")
 
     # Check environment variables
-    required_vars = ["OPENAI_API_KEY", "SUPABASE_URL", "SUPABASE_KEY"]
-    missing_vars = [var for var in required_vars if not os.getenv(var)]
+    missing_vars = [var for var in REQUIRED_ENV_VARS if not os.environ.get(var)]
 
     if missing_vars:
         print(f"❌ Missing environment variables: {', '.join(missing_vars)}")
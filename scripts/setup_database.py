@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Run the database setup SQL (src/database/table.sql) over a direct
+PostgreSQL connection as one script instead of pasting it into the
+Supabase SQL editor.
+
+Requires DATABASE_URL in the environment (use the pooled Supavisor
+endpoint, see .env.example) and the psycopg package:
+
+    uv pip install psycopg
+"""
+
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+TABLE_SQL = Path(__file__).resolve().parent.parent / "src" / "database" / "table.sql"
+
+
+def main() -> int:
+    database_url = os.environ.get("DATABASE_URL")
+    if not database_url:
+        print("❌ DATABASE_URL is not set (see .env.example)")
+        return 1
+
+    try:
+        import psycopg
+    except ImportError:
+        print("❌ psycopg is not installed: uv pip install psycopg")
+        return 1
+
+    sql = TABLE_SQL.read_text(encoding="utf-8")
+
+    # table.sql wraps itself in BEGIN/COMMIT, so connect with autocommit
+    # and let the script manage its own transaction; the whole setup runs
+    # in a single round trip
+    with psycopg.connect(database_url, autocommit=True) as conn:
+        conn.execute(sql)
+
+    print("✅ Database setup complete")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,124 +1,485 @@
-"""
-Supabase database configuration and vector store setup
-"""
-
-import json
-import logging
-import os
-from typing import Dict, List, Optional
-
-from langchain.schema import Document
-from langchain_openai import OpenAIEmbeddings
-from supabase import Client, create_client
-
-logger = logging.getLogger(__name__)
-
-
-class SupabaseManager:
-    """Manages Supabase client and vector operations"""
-
-    def __init__(self):
-        self.supabase_url = os.getenv("SUPABASE_URL")
-        self.supabase_key = os.getenv("SUPABASE_KEY")
-        if not self.supabase_url or not self.supabase_key:
-            raise ValueError(
-                "SUPABASE_URL and SUPABASE_KEY must be set in environment variables"
-            )
-
-        self.client: Client = create_client(self.supabase_url, self.supabase_key)
-        self.embeddings = OpenAIEmbeddings()
-        self.table_name = "documents"
-
-    def add_documents(self, documents: List[Document]) -> List[str]:
-        """Add documents to the vector store"""
-        try:
-            ids = []
-            for doc in documents:
-                # Create embedding for the document
-                embedding = self.embeddings.embed_query(doc.page_content)
-                
-                # Prepare document data
-                doc_data = {
-                    "content": doc.page_content,
-                    "metadata": doc.metadata,
-                    "embedding": embedding
-                }
-                
-                # Insert into database
-                result = self.client.table(self.table_name).insert(doc_data).execute()
-                
-                if result.data:
-                    ids.append(str(result.data[0]['id']))
-            
-            logger.info(f"Added {len(documents)} documents to vector store")
-            return ids
-        except Exception as e:
-            logger.error(f"Failed to add documents: {e}")
-            raise
-
-    def similarity_search(
-        self, query: str, k: int = 4, filter: Optional[Dict] = None
-    ) -> List[Document]:
-        """Search for similar documents"""
-        try:
-            # Create embedding for the query
-            query_embedding = self.embeddings.embed_query(query)
-            
-            # Prepare RPC call parameters
-            params = {
-                "query_embedding": query_embedding,
-                "match_count": k
-            }
-            
-            if filter:
-                params["filter"] = filter
-            
-            # Call the match_documents function
-            response = self.client.rpc("match_documents", params).execute()
-            
-            # Convert results to Document objects
-            documents = []
-            for item in response.data:
-                doc = Document(
-                    page_content=item["content"],
-                    metadata=item.get("metadata", {})
-                )
-                documents.append(doc)
-            
-            logger.info(f"Found {len(documents)} similar documents for query")
-            return documents
-            
-        except Exception as e:
-            logger.error(f"Similarity search failed: {e}")
-            raise
-
-    def similarity_search_with_score(self, query: str, k: int = 4) -> List[tuple]:
-        """Search for similar documents with similarity scores"""
-        try:
-            # Create embedding for the query
-            query_embedding = self.embeddings.embed_query(query)
-            
-            # Call the match_documents function
-            params = {
-                "query_embedding": query_embedding,
-                "match_count": k
-            }
-            
-            response = self.client.rpc("match_documents", params).execute()
-            
-            # Convert results to tuples of (Document, score)
-            results = []
-            for item in response.data:
-                doc = Document(
-                    page_content=item["content"],
-                    metadata=item.get("metadata", {})
-                )
-                score = item.get("similarity", 0.0)
-                results.append((doc, score))
-            
-            logger.info(f"Found {len(results)} similar documents with scores")
-            return results
-            
-        except Exception as e:
-            logger.error(f"Similarity search with score failed: {e}")
+"""
+Supabase database configuration and vector store setup
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.schema import Document
+from langchain_openai import OpenAIEmbeddings
+from supabase import Client, create_client
+
+logger = logging.getLogger(__name__)
+
+# Embedding model used for stored documents and queries (pinned to what
+# OpenAIEmbeddings defaulted to when the table was populated)
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# Maximum number of texts sent to the embeddings API in one request
+EMBED_BATCH_SIZE = 1024
+
+# Maximum number of rows sent to PostgREST in one insert
+INSERT_BATCH_SIZE = 500
+
+# Retrieval result cache bounds
+RETRIEVAL_CACHE_TTL = 300  # seconds
+RETRIEVAL_CACHE_SIZE = 256
+
+
+def _retrieval_cache_key(
+    query_embedding: List[float], k: int, filter: Optional[Dict]
+) -> str:
+    """Build a cache key from a quantized embedding hash plus search params"""
+    quantized = np.round(np.asarray(query_embedding, dtype=np.float32), 3).astype(
+        np.float16
+    )
+    digest = hashlib.blake2b(quantized.tobytes(), digest_size=16).hexdigest()
+    filter_part = json.dumps(filter, sort_keys=True) if filter else ""
+    return f"{digest}:{k}:{filter_part}"
+
+
+def _l2_normalize(embedding: List[float]) -> np.ndarray:
+    """Return the embedding as a unit-norm float32 vector"""
+    vec = np.asarray(embedding, dtype=np.float32)
+    return vec / (np.linalg.norm(vec) + 1e-12)
+
+
+def _to_halfvec(embedding: List[float]) -> List[float]:
+    """Normalize and round an embedding to FP16 for the halfvec column
+
+    Insert-side normalization lets match_documents use the inner-product
+    operator instead of recomputing norms per row.
+    """
+    return _l2_normalize(embedding).astype(np.float16).tolist()
+
+
+def _content_hash(text: str) -> str:
+    """Return the SHA-256 hex digest of document content"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@lru_cache(maxsize=1)
+def _get_client(supabase_url: str, supabase_key: str) -> Client:
+    """Return a process-wide shared Supabase client
+
+    One client means one underlying postgrest HTTP session, so requests
+    reuse its keep-alive connections instead of re-handshaking TLS per
+    manager instance.
+    """
+    return create_client(supabase_url, supabase_key)
+
+
+@lru_cache(maxsize=4)
+def _embeddings_for(model_name: str) -> OpenAIEmbeddings:
+    """Return a shared embeddings client for the given model"""
+    return OpenAIEmbeddings(model=model_name)
+
+
+@lru_cache(maxsize=1024)
+def _embed_query_cached(model_name: str, query: str) -> np.ndarray:
+    """Embed a query, memoizing results so repeated queries skip the API call
+
+    Stored as a read-only float32 array: roughly 7x smaller than a list of
+    Python floats, and downstream cosine math runs on it without conversion.
+    """
+    vec = np.asarray(_embeddings_for(model_name).embed_query(query), dtype=np.float32)
+    vec.flags.writeable = False
+    return vec
+
+
+class ProximityCache:
+    """Semantic cache mapping recent query embeddings to retrieved documents
+
+    Cached query vectors are L2-normalized at insert so cosine similarity
+    against a new query reduces to one matrix-vector product.
+    """
+
+    def __init__(self, threshold: float = 0.95, capacity: int = 256):
+        self.threshold = threshold
+        self.capacity = capacity
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Tuple[int, List[Document]]] = []
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+        return vec
+
+    def get(self, query_embedding: List[float], k: int) -> Optional[List[Document]]:
+        """Return cached documents for a similar-enough query with the same k"""
+        if self._vectors is None:
+            return None
+
+        sims = self._vectors @ self._normalize(query_embedding)
+        for idx in np.argsort(sims)[::-1]:
+            if sims[idx] < self.threshold:
+                break
+            entry_k, documents = self._entries[idx]
+            if entry_k == k:
+                return documents
+        return None
+
+    def add(self, query_embedding: List[float], k: int, documents: List[Document]) -> None:
+        """Cache documents for a query embedding, evicting the oldest entry"""
+        vec = self._normalize(query_embedding)[np.newaxis, :]
+        if self._vectors is None:
+            self._vectors = vec
+        else:
+            self._vectors = np.vstack([self._vectors, vec])
+        self._entries.append((k, documents))
+
+        if len(self._entries) > self.capacity:
+            self._vectors = self._vectors[1:]
+            self._entries.pop(0)
+
+    def clear(self) -> None:
+        """Drop all cached entries, e.g. after new documents are ingested"""
+        self._vectors = None
+        self._entries = []
+
+
+class SupabaseManager:
+    """Manages Supabase client and vector operations"""
+
+    def __init__(self, semantic_cache_threshold: float = 0.95):
+        self.supabase_url = os.getenv("SUPABASE_URL")
+        self.supabase_key = os.getenv("SUPABASE_KEY")
+        if not self.supabase_url or not self.supabase_key:
+            raise ValueError(
+                "SUPABASE_URL and SUPABASE_KEY must be set in environment variables"
+            )
+
+        self.client: Client = _get_client(self.supabase_url, self.supabase_key)
+        self.embeddings = _embeddings_for(EMBEDDING_MODEL)
+        self.table_name = "documents"
+        # TTL-bounded LRU of recent retrieval results
+        self._retrieval_cache: OrderedDict = OrderedDict()
+        # Semantic cache for paraphrased queries
+        self._proximity_cache = ProximityCache(threshold=semantic_cache_threshold)
+
+    def add_documents(
+        self, documents: List[Document], return_ids: bool = False
+    ) -> List[str]:
+        """Add documents to the vector store
+
+        With return_ids=False (the default) the insert asks PostgREST for a
+        minimal response, skipping the serialization of the inserted rows
+        (including their embeddings) back over the wire.
+        """
+        if not documents:
+            return []
+
+        try:
+            # Skip chunks whose content is already stored
+            documents, hashes = self._dedupe_documents(documents)
+            if not documents:
+                logger.info("All documents already in vector store, nothing to add")
+                return []
+
+            # Embed all documents in batched API calls
+            texts = [doc.page_content for doc in documents]
+            embeddings = []
+            for i in range(0, len(texts), EMBED_BATCH_SIZE):
+                embeddings.extend(
+                    self.embeddings.embed_documents(texts[i : i + EMBED_BATCH_SIZE])
+                )
+
+            # Prepare rows for bulk inserts
+            rows = [
+                {
+                    "content": text,
+                    "metadata": {**doc.metadata, "content_hash": content_hash},
+                    "embedding": _to_halfvec(embedding),
+                }
+                for text, doc, embedding, content_hash in zip(
+                    texts, documents, embeddings, hashes
+                )
+            ]
+
+            # Insert in slices that stay under PostgREST payload limits
+            returning = "representation" if return_ids else "minimal"
+            ids = []
+            for i in range(0, len(rows), INSERT_BATCH_SIZE):
+                result = (
+                    self.client.table(self.table_name)
+                    .insert(rows[i : i + INSERT_BATCH_SIZE], returning=returning)
+                    .execute()
+                )
+                ids.extend(str(item["id"]) for item in (result.data or []))
+
+            # New rows can change what any query should retrieve, so the
+            # local retrieval caches must not serve pre-ingest results
+            self._invalidate_retrieval_caches()
+
+            logger.info(f"Added {len(documents)} documents to vector store")
+            return ids
+        except Exception as e:
+            logger.error(f"Failed to add documents: {e}")
+            raise
+
+    def _invalidate_retrieval_caches(self) -> None:
+        """Clear the exact and semantic retrieval caches after an ingest"""
+        self._retrieval_cache.clear()
+        self._proximity_cache.clear()
+
+    def _existing_content_hashes(self, hashes: List[str]) -> set:
+        """Return the subset of content hashes already stored in the table"""
+        try:
+            response = (
+                self.client.table(self.table_name)
+                .select("metadata->>content_hash")
+                .in_("metadata->>content_hash", sorted(set(hashes)))
+                .execute()
+            )
+            return {
+                item["content_hash"]
+                for item in (response.data or [])
+                if item.get("content_hash")
+            }
+        except Exception as e:
+            logger.warning(f"Content hash lookup failed, inserting all documents: {e}")
+            return set()
+
+    def _dedupe_documents(self, documents: List[Document]) -> tuple:
+        """Drop documents whose content hash is already stored or repeats in the batch"""
+        hashes = [_content_hash(doc.page_content) for doc in documents]
+        seen = self._existing_content_hashes(hashes)
+
+        unique_docs = []
+        unique_hashes = []
+        for doc, content_hash in zip(documents, hashes):
+            if content_hash in seen:
+                continue
+            seen.add(content_hash)
+            unique_docs.append(doc)
+            unique_hashes.append(content_hash)
+
+        skipped = len(documents) - len(unique_docs)
+        if skipped:
+            logger.info(f"Skipped {skipped} already-ingested document chunks")
+        return unique_docs, unique_hashes
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Create an embedding for a query using the shared LRU cache"""
+        return _embed_query_cached(self.embeddings.model, query)
+
+    async def aadd_documents(
+        self, documents: List[Document], return_ids: bool = False
+    ) -> List[str]:
+        """Add documents to the vector store without blocking the event loop"""
+        if not documents:
+            return []
+
+        try:
+            # Skip chunks whose content is already stored
+            documents, hashes = await asyncio.to_thread(
+                self._dedupe_documents, documents
+            )
+            if not documents:
+                logger.info("All documents already in vector store, nothing to add")
+                return []
+
+            texts = [doc.page_content for doc in documents]
+
+            # Fan embedding batches out concurrently instead of awaiting
+            # each round trip in sequence
+            batches = [
+                texts[i : i + EMBED_BATCH_SIZE]
+                for i in range(0, len(texts), EMBED_BATCH_SIZE)
+            ]
+            batch_results = await asyncio.gather(
+                *(self.embeddings.aembed_documents(batch) for batch in batches)
+            )
+            embeddings = [
+                embedding for batch in batch_results for embedding in batch
+            ]
+
+            rows = [
+                {
+                    "content": text,
+                    "metadata": {**doc.metadata, "content_hash": content_hash},
+                    "embedding": _to_halfvec(embedding),
+                }
+                for text, doc, embedding, content_hash in zip(
+                    texts, documents, embeddings, hashes
+                )
+            ]
+
+            # supabase-py's insert is synchronous, so run it in a thread;
+            # slices stay under PostgREST payload limits
+            returning = "representation" if return_ids else "minimal"
+            ids = []
+            for i in range(0, len(rows), INSERT_BATCH_SIZE):
+                result = await asyncio.to_thread(
+                    self.client.table(self.table_name)
+                    .insert(rows[i : i + INSERT_BATCH_SIZE], returning=returning)
+                    .execute
+                )
+                ids.extend(str(item["id"]) for item in (result.data or []))
+
+            # New rows can change what any query should retrieve, so the
+            # local retrieval caches must not serve pre-ingest results
+            self._invalidate_retrieval_caches()
+
+            logger.info(f"Added {len(documents)} documents to vector store")
+            return ids
+        except Exception as e:
+            logger.error(f"Failed to add documents: {e}")
+            raise
+
+    def similarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[Document]:
+        """Search for similar documents
+
+        ef_search overrides the HNSW candidate-list size for this query;
+        higher values trade latency for recall.
+        """
+        try:
+            # Create embedding for the query (cached for repeated queries)
+            query_embedding = _embed_query_cached(self.embeddings.model, query)
+
+            # Serve recent identical searches from the local cache
+            cache_key = _retrieval_cache_key(query_embedding, k, filter)
+            if ef_search is not None:
+                cache_key = f"{cache_key}:ef{ef_search}"
+            cached = self._retrieval_cache_get(cache_key)
+            if cached is not None:
+                logger.info(f"Retrieval cache hit for query: {query}")
+                return cached
+
+            # Then try the semantic cache for paraphrased queries (skipped
+            # for filtered or recall-tuned searches, which it doesn't key on)
+            if not filter and ef_search is None:
+                similar = self._proximity_cache.get(query_embedding, k)
+                if similar is not None:
+                    logger.info(f"Semantic retrieval cache hit for query: {query}")
+                    return similar
+
+            # Call the match_documents function
+            documents = self._search(query_embedding, k, filter, ef_search=ef_search)
+
+            self._retrieval_cache_put(cache_key, documents)
+            if not filter and ef_search is None:
+                self._proximity_cache.add(query_embedding, k, documents)
+
+            logger.info(f"Found {len(documents)} similar documents for query")
+            return documents
+
+        except Exception as e:
+            logger.error(f"Similarity search failed: {e}")
+            raise
+
+    def _search(
+        self,
+        query_embedding: List[float],
+        k: int,
+        filter: Optional[Dict] = None,
+        want_score: bool = False,
+        ef_search: Optional[int] = None,
+    ):
+        """Run match_documents for an already-computed query embedding"""
+        params = {
+            # Normalized to match the inner-product distance in the RPC
+            "query_embedding": _l2_normalize(query_embedding).tolist(),
+            "match_count": k
+        }
+
+        if filter:
+            params["filter"] = filter
+
+        if ef_search is not None:
+            params["ef_search"] = ef_search
+
+        response = self.client.rpc("match_documents", params).execute()
+
+        results = []
+        for item in response.data:
+            doc = Document(
+                page_content=item["content"],
+                metadata=item.get("metadata", {})
+            )
+            results.append((doc, item.get("similarity", 0.0)) if want_score else doc)
+        return results
+
+    def similarity_search_with_embedding(
+        self, query_embedding: List[float], k: int = 4, filter: Optional[Dict] = None
+    ) -> List[Document]:
+        """Search with an embedding computed elsewhere (e.g. by a cache layer)
+
+        Skips re-embedding entirely for callers that already hold the
+        query vector.
+        """
+        try:
+            return self._search(query_embedding, k, filter)
+        except Exception as e:
+            logger.error(f"Similarity search failed: {e}")
+            raise
+
+    def _retrieval_cache_get(self, key: str):
+        """Return cached documents for a key unless the entry has expired"""
+        entry = self._retrieval_cache.get(key)
+        if entry is None:
+            return None
+
+        timestamp, documents = entry
+        if time.monotonic() - timestamp > RETRIEVAL_CACHE_TTL:
+            del self._retrieval_cache[key]
+            return None
+
+        self._retrieval_cache.move_to_end(key)
+        return documents
+
+    def _retrieval_cache_put(self, key: str, documents: List[Document]) -> None:
+        """Cache documents for a key, evicting the least recently used entry"""
+        self._retrieval_cache[key] = (time.monotonic(), documents)
+        self._retrieval_cache.move_to_end(key)
+        while len(self._retrieval_cache) > RETRIEVAL_CACHE_SIZE:
+            self._retrieval_cache.popitem(last=False)
+
+    async def asimilarity_search(
+        self,
+        query: str,
+        k: int = 4,
+        filter: Optional[Dict] = None,
+        ef_search: Optional[int] = None,
+    ) -> List[Document]:
+        """Async similarity search that keeps the event loop free
+
+        Runs the synchronous search (including its embedding and retrieval
+        caches) in a worker thread, so concurrent requests overlap their
+        network I/O instead of serializing.
+        """
+        return await asyncio.to_thread(
+            self.similarity_search, query, k, filter, ef_search
+        )
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> List[tuple]:
+        """Search for similar documents with similarity scores"""
+        try:
+            # Create embedding for the query (cached for repeated queries)
+            query_embedding = _embed_query_cached(self.embeddings.model, query)
+
+            results = self._search(query_embedding, k, want_score=True)
+
+            logger.info(f"Found {len(results)} similar documents with scores")
+            return results
+
+        except Exception as e:
+            logger.error(f"Similarity search with score failed: {e}")
             raise
\ No newline at end of file
@@ -1,27 +1,36 @@
+-- Koko setup ajetaan yhtenä transaktiona, jotta se on atominen
+BEGIN;
+
 -- 1. Ota pgvector käyttöön
 CREATE EXTENSION IF NOT EXISTS vector;
 
 -- 2. Poista vanha funktio JOS SE ON OLEMASSA
 DROP FUNCTION IF EXISTS match_documents(vector, integer, jsonb);
+DROP FUNCTION IF EXISTS match_documents(halfvec, integer, jsonb);
+DROP FUNCTION IF EXISTS match_documents(halfvec, integer, jsonb, integer);
 
 -- 3. Poista vanha taulu jos on olemassa
 DROP TABLE IF EXISTS documents CASCADE;
 
 -- 4. Luo documents taulu
+-- halfvec (FP16) puolittaa rivin embedding-koon FP32:een verrattuna,
+-- mikä vähentää muistiliikennettä hakujen aikana.
+-- HUOM: embeddingit L2-normalisoidaan Python-puolella ennen insertiä,
+-- joten sisätulo (<#>) vastaa kosinisimilariteettia ilman normilaskentaa
 CREATE TABLE IF NOT EXISTS documents (
     id BIGSERIAL PRIMARY KEY,
     content TEXT,
     metadata JSONB,
-    embedding VECTOR(1536)
+    embedding HALFVEC(1536)
 );
 
 -- 5. Luo match_documents funktio
 CREATE OR REPLACE FUNCTION match_documents (
-    query_embedding VECTOR(1536),
+    query_embedding HALFVEC(1536),
     match_count INT DEFAULT NULL,
-    filter JSONB DEFAULT '{}'
+    filter JSONB DEFAULT '{}',
+    ef_search INT DEFAULT 40
 ) RETURNS TABLE (
-    id BIGINT,
     content TEXT,
     metadata JSONB,
     similarity FLOAT
@@ -30,19 +39,39 @@ LANGUAGE plpgsql
 AS $$
 #variable_conflict use_column
 BEGIN
+    -- Rajaa HNSW-haun kandidaattilistan koko tälle kyselylle;
+    -- suurempi ef_search parantaa recallia, pienempi nopeuttaa hakua
+    PERFORM set_config('hnsw.ef_search', ef_search::text, true);
+
+    -- Aja HNSW-skannaus ensin (ylihaku 4x) ja suodata metadata vasta sen
+    -- jälkeen, jotta valikoiva suodatin ei pakota seq scan + sort -polkua
+    -- Palauta vain kentät joita Python-puoli käyttää; embeddingin
+    -- (1536 floattia JSONina) palauttaminen olisi pelkkää kaistahukkaa
     RETURN QUERY
     SELECT
-        documents.id,
-        documents.content,
-        documents.metadata,
-        1 - (documents.embedding <=> query_embedding) AS similarity
-    FROM documents
-    WHERE metadata @> filter
-    ORDER BY documents.embedding <=> query_embedding
+        t.content,
+        t.metadata,
+        t.similarity
+    FROM (
+        SELECT
+            documents.content,
+            documents.metadata,
+            -(documents.embedding <#> query_embedding) AS similarity
+        FROM documents
+        ORDER BY documents.embedding <#> query_embedding
+        LIMIT match_count * 4
+    ) t
+    WHERE t.metadata @> filter
+    ORDER BY t.similarity DESC
     LIMIT match_count;
 END;
 $$;
 
 -- 6. Luo indeksi
-CREATE INDEX IF NOT EXISTS documents_embedding_idx ON documents 
-USING hnsw (embedding vector_cosine_ops);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS documents_embedding_idx ON documents
+USING hnsw (embedding halfvec_ip_ops) WITH (m = 16, ef_construction = 64);
+
+CREATE INDEX IF NOT EXISTS documents_metadata_idx ON documents
+USING gin (metadata);
+
+COMMIT;
\ No newline at end of file
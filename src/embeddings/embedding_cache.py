@@ -0,0 +1,72 @@
+"""
+Persistent on-disk cache for document embeddings
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# SQLite limits the number of bound parameters per statement
+_SELECT_BATCH_SIZE = 500
+
+
+class EmbeddingCache:
+    """SQLite-backed embedding cache keyed by SHA-256(model + text)
+
+    Survives process restarts, so re-ingesting unchanged content doesn't
+    pay for the same OpenAI embeddings again. Vectors are stored as raw
+    float32 bytes.
+    """
+
+    def __init__(self, path: str = "embeddings.db"):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS emb (k BLOB PRIMARY KEY, v BLOB)"
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> bytes:
+        """Build a cache key from the model name and chunk text"""
+        payload = model_name.encode("utf-8") + b"\x00" + text.encode("utf-8")
+        return hashlib.sha256(payload).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, List[float]]:
+        """Return cached embeddings for the given keys"""
+        found: Dict[bytes, List[float]] = {}
+        with self._lock:
+            for i in range(0, len(keys), _SELECT_BATCH_SIZE):
+                batch = keys[i : i + _SELECT_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.conn.execute(
+                    f"SELECT k, v FROM emb WHERE k IN ({placeholders})", batch
+                ).fetchall()
+                for key, value in rows:
+                    found[key] = np.frombuffer(value, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, pairs: Iterable[Tuple[bytes, List[float]]]) -> None:
+        """Store embeddings for the given keys in one transaction"""
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes())
+            for key, vector in pairs
+        ]
+        if not rows:
+            return
+
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO emb (k, v) VALUES (?, ?)", rows
+            )
+
+    def close(self) -> None:
+        """Close the underlying SQLite connection"""
+        self.conn.close()
@@ -3,43 +3,90 @@ Embedding utilities for document processing and vector creation
 """
 
 from dotenv import load_dotenv
+import asyncio
 import logging
 import os
-from typing import Any, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
 
+import tiktoken
 from langchain.schema import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 
+try:
+    from .embedding_cache import EmbeddingCache
+except ImportError:
+    # Fallback for direct execution
+    from embedding_cache import EmbeddingCache
+
 logger = logging.getLogger(__name__)
 # Ensure environment variables are loaded
 load_dotenv()
 
+# Window size for streaming file reads
+READ_WINDOW_SIZE = 64 * 1024
+
+
+@lru_cache(maxsize=1)
+def _get_encoder() -> "tiktoken.Encoding":
+    """Return the cl100k_base tokenizer shared by all managers"""
+    return tiktoken.get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=4)
+def _get_embeddings(model_name: str) -> OpenAIEmbeddings:
+    """Return a shared embeddings client per model instead of one per manager"""
+    return OpenAIEmbeddings(model=model_name)
+
+
+@lru_cache(maxsize=2048)
+def _cached_embed(model_name: str, text: str) -> tuple:
+    """Embed text, memoized per (model, text) so repeats skip the API call"""
+    return tuple(_get_embeddings(model_name).embed_query(text))
+
 
 class EmbeddingManager:
     """Manages text embeddings and document processing"""
 
-    def __init__(self, model_name: str = "text-embedding-3-small"):
+    def __init__(
+        self,
+        model_name: str = "text-embedding-3-small",
+        cache_path: Optional[str] = "embeddings.db",
+    ):
         self.model_name = model_name
 
         # Only initialize embeddings if API key is available
         api_key = os.getenv("OPENAI_API_KEY")
         if api_key:
-            self.embeddings = OpenAIEmbeddings(model=model_name)
+            self.embeddings = _get_embeddings(model_name)
         else:
             self.embeddings = None
 
-        # Configure text splitter
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
+        # On-disk embedding cache; pass cache_path=None to disable
+        self.embedding_cache = EmbeddingCache(cache_path) if cache_path else None
+
+        # Configure text splitter; chunk sizes are measured in tokens so
+        # chunks stay uniform regardless of language (Finnish words would
+        # skew a character-based measure badly)
+        self.text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            encoding_name="cl100k_base",
+            chunk_size=500,
+            chunk_overlap=50,
             separators=["\n\n", "\n", " ", ""],
         )
 
     def count_tokens(self, text: str) -> int:
-        """Count approximate tokens in text using character count / 4"""
-        return len(text) // 4  # Rough approximation: 1 token ≈ 4 characters
+        """Count tokens in text with the cl100k_base tokenizer"""
+        return len(_get_encoder().encode_ordinary(text))
+
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Count tokens for multiple texts, parallelized across cores"""
+        encoded = _get_encoder().encode_ordinary_batch(
+            texts, num_threads=os.cpu_count() or 1
+        )
+        return [len(ids) for ids in encoded]
 
     def chunk_text(self, text: str) -> List[str]:
         """Split text into chunks and return as strings"""
@@ -62,15 +109,18 @@ class EmbeddingManager:
             # Split the text into chunks
             chunks = self.text_splitter.split_text(text)
 
+            # Count tokens for all chunks in one batched tokenizer call
+            token_counts = self.count_tokens_batch(chunks)
+
             # Create Document objects
             documents = []
-            for i, chunk in enumerate(chunks):
+            for i, (chunk, token_count) in enumerate(zip(chunks, token_counts)):
                 doc_metadata = metadata.copy()
                 doc_metadata.update(
                     {
                         "chunk_index": i,
                         "total_chunks": len(chunks),
-                        "token_count": self.count_tokens(chunk),
+                        "token_count": token_count,
                     }
                 )
 
@@ -83,6 +133,31 @@ class EmbeddingManager:
             logger.error(f"Failed to split text: {e}")
             raise
 
+    def _iter_chunk_texts(self, file_path: str) -> Iterator[str]:
+        """Yield split chunks from a file, reading it in bounded windows
+
+        Keeps the working set independent of file size: only one window of
+        raw text is held at a time, and the last chunk of each window is
+        carried over so overlap across window boundaries is preserved.
+        """
+        buffer = ""
+        with open(file_path, "r", encoding="utf-8") as file:
+            while True:
+                block = file.read(READ_WINDOW_SIZE)
+                if not block:
+                    break
+                buffer += block
+                if len(buffer) < READ_WINDOW_SIZE:
+                    continue
+
+                chunks = self.text_splitter.split_text(buffer)
+                if len(chunks) > 1:
+                    yield from chunks[:-1]
+                    buffer = chunks[-1]
+
+        if buffer:
+            yield from self.text_splitter.split_text(buffer)
+
     def process_file(
         self, file_path: str, additional_metadata: Optional[Dict[str, Any]] = None
     ) -> List[Document]:
@@ -91,9 +166,10 @@ class EmbeddingManager:
             additional_metadata = {}
 
         try:
-            # Read file content
-            with open(file_path, "r", encoding="utf-8") as file:
-                content = file.read()
+            # Read and split incrementally instead of materializing the
+            # whole file as one string before splitting
+            chunks = list(self._iter_chunk_texts(file_path))
+            token_counts = self.count_tokens_batch(chunks)
 
             # Prepare metadata
             metadata = {
@@ -103,8 +179,18 @@ class EmbeddingManager:
             }
             metadata.update(additional_metadata)
 
-            # Split into chunks
-            documents = self.split_text_into_chunks(content, metadata)
+            documents = [
+                Document(
+                    page_content=chunk,
+                    metadata={
+                        **metadata,
+                        "chunk_index": i,
+                        "total_chunks": len(chunks),
+                        "token_count": token_count,
+                    },
+                )
+                for i, (chunk, token_count) in enumerate(zip(chunks, token_counts))
+            ]
 
             logger.info(f"Processed file {file_path} into {len(documents)} chunks")
             return documents
@@ -115,15 +201,48 @@ class EmbeddingManager:
 
     def process_multiple_files(self, file_paths: List[str]) -> List[Document]:
         """Process multiple files and return all document chunks"""
+        if not file_paths:
+            return []
+
         all_documents = []
 
-        for file_path in file_paths:
-            try:
-                documents = self.process_file(file_path)
-                all_documents.extend(documents)
-            except Exception as e:
-                logger.warning(f"Skipping file {file_path} due to error: {e}")
-                continue
+        # Overlap file reads and splitting across a bounded thread pool;
+        # files that fail are skipped, as before
+        with ThreadPoolExecutor(max_workers=min(32, len(file_paths))) as executor:
+            futures = [
+                executor.submit(self.process_file, file_path)
+                for file_path in file_paths
+            ]
+            for file_path, future in zip(file_paths, futures):
+                try:
+                    all_documents.extend(future.result())
+                except Exception as e:
+                    logger.warning(f"Skipping file {file_path} due to error: {e}")
+                    continue
+
+        logger.info(
+            f"Processed {len(file_paths)} files into {len(all_documents)} total chunks"
+        )
+        return all_documents
+
+    async def aprocess_multiple_files(self, file_paths: List[str]) -> List[Document]:
+        """Process multiple files concurrently in worker threads
+
+        File reads overlap instead of running back to back; a semaphore
+        bounds concurrency so large batches don't exhaust file handles.
+        """
+        semaphore = asyncio.Semaphore(8)
+
+        async def process(file_path: str) -> List[Document]:
+            async with semaphore:
+                try:
+                    return await asyncio.to_thread(self.process_file, file_path)
+                except Exception as e:
+                    logger.warning(f"Skipping file {file_path} due to error: {e}")
+                    return []
+
+        results = await asyncio.gather(*(process(path) for path in file_paths))
+        all_documents = [doc for documents in results for doc in documents]
 
         logger.info(
             f"Processed {len(file_paths)} files into {len(all_documents)} total chunks"
@@ -131,23 +250,67 @@ class EmbeddingManager:
         return all_documents
 
     def embed_query(self, query: str) -> List[float]:
-        """Create embedding for a query"""
+        """Create embedding for a query (LRU-cached per model and text)"""
         if not self.embeddings:
             raise ValueError("OpenAI API key not available. Cannot create embeddings.")
         try:
-            embedding = self.embeddings.embed_query(query)
-            return embedding
+            return list(_cached_embed(self.model_name, query))
         except Exception as e:
             logger.error(f"Failed to embed query: {e}")
             raise
 
+    def cache_stats(self) -> Dict[str, int]:
+        """Return hit/miss statistics for the query embedding cache"""
+        info = _cached_embed.cache_info()
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "maxsize": info.maxsize,
+        }
+
+    def clear_embedding_cache(self) -> None:
+        """Clear the query embedding cache (e.g. after switching API keys)"""
+        _cached_embed.cache_clear()
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        """Create embeddings for multiple documents"""
+        """Create embeddings for multiple documents
+
+        Embeddings already present in the on-disk cache are served from
+        SQLite; only cache misses go to the OpenAI API, and their vectors
+        are written back for later runs.
+        """
         if not self.embeddings:
             raise ValueError("OpenAI API key not available. Cannot create embeddings.")
         try:
-            embeddings = self.embeddings.embed_documents(texts)
-            logger.info(f"Created embeddings for {len(texts)} documents")
+            if self.embedding_cache is None:
+                embeddings = self.embeddings.embed_documents(texts)
+                logger.info(f"Created embeddings for {len(texts)} documents")
+                return embeddings
+
+            keys = [EmbeddingCache.make_key(self.model_name, text) for text in texts]
+            hits = self.embedding_cache.get_many(keys)
+
+            miss_indices = [i for i, key in enumerate(keys) if key not in hits]
+            miss_vectors = (
+                self.embeddings.embed_documents([texts[i] for i in miss_indices])
+                if miss_indices
+                else []
+            )
+            self.embedding_cache.put_many(
+                (keys[i], vector) for i, vector in zip(miss_indices, miss_vectors)
+            )
+
+            # Merge hits and fresh embeddings back into input order
+            miss_iter = iter(miss_vectors)
+            embeddings = [
+                hits[key] if key in hits else next(miss_iter) for key in keys
+            ]
+
+            logger.info(
+                f"Created embeddings for {len(texts)} documents "
+                f"({len(hits)} served from cache)"
+            )
             return embeddings
         except Exception as e:
             logger.error(f"Failed to embed documents: {e}")
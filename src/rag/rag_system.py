@@ -1,134 +1,515 @@
-"""
-RAG System - Simple MVP version
-"""
-
-import logging
-from typing import Any, Dict, List, Optional
-
-from langchain.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-
-try:
-    from ..database.supabase_manager import SupabaseManager
-    from ..embeddings.embedding_manager import EmbeddingManager
-except ImportError:
-    # Fallback for direct execution
-    import sys
-    from pathlib import Path
-
-    sys.path.append(str(Path(__file__).parent.parent))
-    from database.supabase_manager import SupabaseManager
-    from embeddings.embedding_manager import EmbeddingManager
-
-logger = logging.getLogger(__name__)
-
-
-class RAGSystem:
-    """Simple RAG system for MVP"""
-
-    def __init__(self, model_name: str = "gpt-4o-mini"):
-        self.llm = ChatOpenAI(model=model_name, temperature=0)
-        self.supabase_manager = SupabaseManager()
-        self.embedding_manager = EmbeddingManager()
-
-    def ask(self, query: str, thread_id: str = "default") -> Dict[str, Any]:
-        """Ask a question and get an answer using the RAG system"""
-        try:
-            # 1. Retrieve relevant documents
-            retrieved_docs = self.supabase_manager.similarity_search(
-                query=query,
-                k=4,  # Retrieve top 4 most relevant documents
-            )
-
-            # 2. Create context from retrieved documents
-            context_parts = []
-            for i, doc in enumerate(retrieved_docs, 1):
-                context_parts.append(f"Document {i}:\n{doc.page_content}\n")
-
-            context = (
-                "\n".join(context_parts)
-                if context_parts
-                else "No relevant documents found."
-            )
-
-            # 3. Generate answer
-            prompt = ChatPromptTemplate.from_messages(
-                [
-                    (
-                        "system",
-                        """Olet avulias assistentti, joka vastaa kysymyksiin annetun kontekstin perusteella. 
-            
-Käytä seuraavaa kontekstia vastataksesi käyttäjän kysymykseen:
-
-{context}
-
-Jos et löydä vastausta kontekstista, sano että et löydä riittävästi tietoa vastaukseen.
-Vastaa aina suomeksi, ellei käyttäjä pyydä muuta kieltä.""",
-                    ),
-                    ("human", "{query}"),
-                ]
-            )
-
-            chain = prompt | self.llm
-            response = chain.invoke({"context": context, "query": query})
-            answer = response.content
-
-            logger.info(f"Generated answer for query: {query}")
-
-            return {
-                "query": query,
-                "answer": answer,
-                "retrieved_docs": retrieved_docs,
-                "context": context,
-            }
-
-        except Exception as e:
-            logger.error(f"RAG system failed: {e}")
-            return {
-                "query": query,
-                "answer": "Anteeksi, tapahtui virhe kysymystä käsiteltäessä.",
-                "retrieved_docs": [],
-                "context": "",
-            }
-
-    def add_documents_from_files(self, file_paths: List[str]) -> bool:
-        """Add documents from files to the knowledge base"""
-        try:
-            # Process files into document chunks
-            documents = self.embedding_manager.process_multiple_files(file_paths)
-
-            if not documents:
-                logger.warning("No documents were processed")
-                return False
-
-            # Add to vector store
-            self.supabase_manager.add_documents(documents)
-
-            logger.info(
-                f"Successfully added {len(documents)} document chunks from {len(file_paths)} files"
-            )
-            return True
-
-        except Exception as e:
-            logger.error(f"Failed to add documents: {e}")
-            return False
-
-    def add_text_document(
-        self, text: str, metadata: Optional[Dict[str, Any]] = None
-    ) -> bool:
-        """Add a text document to the knowledge base"""
-        try:
-            # Process text into chunks
-            documents = self.embedding_manager.split_text_into_chunks(text, metadata)
-
-            # Add to vector store
-            self.supabase_manager.add_documents(documents)
-
-            logger.info(
-                f"Successfully added text document with {len(documents)} chunks"
-            )
-            return True
-
-        except Exception as e:
-            logger.error(f"Failed to add text document: {e}")
-            return False
+"""
+RAG System - Simple MVP version
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
+
+try:
+    from ..database.supabase_manager import SupabaseManager
+    from ..embeddings.embedding_manager import EmbeddingManager
+except ImportError:
+    # Fallback for direct execution
+    import sys
+    from pathlib import Path
+
+    sys.path.append(str(Path(__file__).parent.parent))
+    from database.supabase_manager import SupabaseManager
+    from embeddings.embedding_manager import EmbeddingManager
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = """Olet avulias assistentti, joka vastaa kysymyksiin annetun kontekstin perusteella.
+
+Käytä seuraavaa kontekstia vastataksesi käyttäjän kysymykseen:
+
+{context}
+
+Jos et löydä vastausta kontekstista, sano että et löydä riittävästi tietoa vastaukseen.
+Vastaa aina suomeksi, ellei käyttäjä pyydä muuta kieltä."""
+
+# Bounds for the file-ingest pipeline: how many pending chunks the queue
+# holds and how many chunks go into each embed-and-insert batch
+INGEST_QUEUE_SIZE = 1024
+INGEST_BATCH_SIZE = 256
+
+# Canned answer when retrieval finds nothing; returned without an LLM call
+NO_CONTEXT_ANSWER = "En löydä riittävästi tietoa vastatakseni kysymykseen."
+
+# Canned answer for the error paths; callers use it to tell failures
+# apart from real answers (e.g. to keep them out of answer caches)
+ERROR_ANSWER = "Anteeksi, tapahtui virhe kysymystä käsiteltäessä."
+
+
+class SemanticCache:
+    """In-process cache that matches queries by embedding similarity"""
+
+    def __init__(self, threshold: float = 0.95, capacity: int = 256):
+        self.threshold = threshold
+        self.capacity = capacity
+        self._vectors: Optional[np.ndarray] = None
+        self._results: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec = vec / norm
+        return vec
+
+    def get(self, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """Return the cached result for a similar-enough query, if any"""
+        if self._vectors is None:
+            return None
+
+        # Vectors are normalized at insert, so cosine similarity is a dot product
+        sims = self._vectors @ self._normalize(embedding)
+        best = int(np.argmax(sims))
+        if sims[best] >= self.threshold:
+            return self._results[best]
+        return None
+
+    def add(self, embedding: List[float], result: Dict[str, Any]) -> None:
+        """Cache the result for a query embedding, evicting the oldest entry"""
+        vec = self._normalize(embedding)[np.newaxis, :]
+        if self._vectors is None:
+            self._vectors = vec
+        else:
+            self._vectors = np.vstack([self._vectors, vec])
+        self._results.append(result)
+
+        if len(self._results) > self.capacity:
+            self._vectors = self._vectors[1:]
+            self._results.pop(0)
+
+    def clear(self) -> None:
+        """Drop all cached results, e.g. after new documents are ingested"""
+        self._vectors = None
+        self._results = []
+
+
+class RAGSystem:
+    """Simple RAG system for MVP"""
+
+    def __init__(self, model_name: str = "gpt-4o-mini"):
+        self.model_name = model_name
+        self.supabase_manager = SupabaseManager()
+        self.embedding_manager = EmbeddingManager()
+        self.semantic_cache = SemanticCache()
+
+    @cached_property
+    def llm(self) -> ChatOpenAI:
+        """Completion client, built on first use
+
+        Ingest-only callers (file uploads, sample data) never ask a
+        question, so they skip constructing the chat client entirely.
+        """
+        return ChatOpenAI(model=self.model_name, temperature=0)
+
+    @cached_property
+    def _chain(self):
+        """Prompt template piped into the LLM; built once on first question"""
+        prompt = ChatPromptTemplate.from_messages(
+            [("system", SYSTEM_PROMPT), ("human", "{query}")]
+        )
+        return prompt | self.llm
+
+    @staticmethod
+    def _build_context(retrieved_docs: List[Any]) -> str:
+        """Format retrieved documents into the prompt context block
+
+        Compact format: every extra newline and blank chunk here is paid
+        for in prompt tokens on each request.
+        """
+        context = "\n\n".join(
+            f"[{i}] {doc.page_content.strip()}"
+            for i, doc in enumerate(retrieved_docs, 1)
+            if doc.page_content.strip()
+        )
+        return context if context else "No relevant documents found."
+
+    def ask(
+        self,
+        query: str,
+        thread_id: str = "default",
+        ef_search: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Ask a question and get an answer using the RAG system
+
+        ef_search tunes the HNSW candidate-list size for this query's
+        retrieval; higher values trade latency for recall. Searches with a
+        non-default ef_search bypass the semantic cache, which doesn't key
+        on it.
+        """
+        try:
+            # 0. Check the semantic cache for a similar earlier question
+            query_embedding = self.supabase_manager.embed_query(query)
+            if ef_search is None:
+                cached = self.semantic_cache.get(query_embedding)
+                if cached is not None:
+                    logger.info(f"Semantic cache hit for query: {query}")
+                    return {**cached, "query": query}
+
+            # 1. Retrieve relevant documents
+            retrieved_docs = self.supabase_manager.similarity_search(
+                query=query,
+                k=4,  # Retrieve top 4 most relevant documents
+                ef_search=ef_search,
+            )
+
+            # With no documents the model can only produce the canned
+            # "not enough information" reply, so skip the LLM round trip
+            if not retrieved_docs:
+                logger.info(f"No documents retrieved for query: {query}")
+                return {
+                    "query": query,
+                    "answer": NO_CONTEXT_ANSWER,
+                    "retrieved_docs": [],
+                    "context": "",
+                }
+
+            # 2. Create context from retrieved documents
+            context = self._build_context(retrieved_docs)
+
+            # 3. Generate answer
+            response = self._chain.invoke({"context": context, "query": query})
+            answer = response.content
+
+            logger.info(f"Generated answer for query: {query}")
+
+            result = {
+                "query": query,
+                "answer": answer,
+                "retrieved_docs": retrieved_docs,
+                "context": context,
+            }
+            if ef_search is None:
+                self.semantic_cache.add(query_embedding, result)
+            return result
+
+        except Exception as e:
+            logger.error(f"RAG system failed: {e}")
+            return {
+                "query": query,
+                "answer": ERROR_ANSWER,
+                "retrieved_docs": [],
+                "context": "",
+                "error": True,
+            }
+
+    async def aask(
+        self,
+        query: str,
+        thread_id: str = "default",
+        ef_search: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """Async variant of ask; overlaps network I/O across concurrent callers"""
+        try:
+            # 0. Check the semantic cache for a similar earlier question
+            query_embedding = await asyncio.to_thread(
+                self.supabase_manager.embed_query, query
+            )
+            if ef_search is None:
+                cached = self.semantic_cache.get(query_embedding)
+                if cached is not None:
+                    logger.info(f"Semantic cache hit for query: {query}")
+                    return {**cached, "query": query}
+
+            # 1. Retrieve relevant documents
+            retrieved_docs = await self.supabase_manager.asimilarity_search(
+                query=query,
+                k=4,
+                ef_search=ef_search,
+            )
+
+            # With no documents the model can only produce the canned
+            # "not enough information" reply, so skip the LLM round trip
+            if not retrieved_docs:
+                logger.info(f"No documents retrieved for query: {query}")
+                return {
+                    "query": query,
+                    "answer": NO_CONTEXT_ANSWER,
+                    "retrieved_docs": [],
+                    "context": "",
+                }
+
+            # 2. Create context from retrieved documents
+            context = self._build_context(retrieved_docs)
+
+            # 3. Generate answer
+            response = await self._chain.ainvoke({"context": context, "query": query})
+            answer = response.content
+
+            logger.info(f"Generated answer for query: {query}")
+
+            result = {
+                "query": query,
+                "answer": answer,
+                "retrieved_docs": retrieved_docs,
+                "context": context,
+            }
+            if ef_search is None:
+                self.semantic_cache.add(query_embedding, result)
+            return result
+
+        except Exception as e:
+            logger.error(f"RAG system failed: {e}")
+            return {
+                "query": query,
+                "answer": ERROR_ANSWER,
+                "retrieved_docs": [],
+                "context": "",
+                "error": True,
+            }
+
+    def ask_stream(
+        self,
+        query: str,
+        thread_id: str = "default",
+        ef_search: Optional[int] = None,
+        on_retrieved: Optional[Callable[[List[Any]], None]] = None,
+    ) -> Iterator[str]:
+        """Ask a question and yield answer tokens as the model generates them
+
+        Streaming cuts perceived latency to the time of the first token
+        instead of the full generation time. Since a generator can only
+        yield text, on_retrieved gives callers a side channel: it is
+        invoked with the retrieved documents before streaming starts.
+        """
+        try:
+            # 1. Retrieve relevant documents
+            retrieved_docs = self.supabase_manager.similarity_search(
+                query=query,
+                k=4,
+                ef_search=ef_search,
+            )
+            if on_retrieved is not None:
+                on_retrieved(retrieved_docs)
+
+            # With no documents the model can only produce the canned
+            # "not enough information" reply, so skip the LLM round trip
+            if not retrieved_docs:
+                logger.info(f"No documents retrieved for query: {query}")
+                yield NO_CONTEXT_ANSWER
+                return
+
+            # 2. Create context from retrieved documents
+            context = self._build_context(retrieved_docs)
+
+            # 3. Stream the answer
+            for chunk in self._chain.stream({"context": context, "query": query}):
+                if chunk.content:
+                    yield chunk.content
+
+            logger.info(f"Streamed answer for query: {query}")
+
+        except Exception as e:
+            logger.error(f"RAG system failed: {e}")
+            yield ERROR_ANSWER
+
+    def add_documents_from_files(self, file_paths: List[str]) -> bool:
+        """Add documents from files to the knowledge base
+
+        File reading and chunking run in producer threads feeding a bounded
+        queue, while this thread drains the queue into fixed-size batches
+        that are embedded and inserted. Embedding of early files overlaps
+        the reading of later ones, and memory stays bounded by the queue
+        instead of growing with the total chunk count.
+        """
+        if not file_paths:
+            return False
+
+        try:
+            chunk_queue: "queue.Queue" = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+
+            def produce() -> None:
+                try:
+                    with ThreadPoolExecutor(
+                        max_workers=min(8, len(file_paths))
+                    ) as executor:
+                        futures = [
+                            executor.submit(self.embedding_manager.process_file, path)
+                            for path in file_paths
+                        ]
+                        for file_path, future in zip(file_paths, futures):
+                            try:
+                                for document in future.result():
+                                    chunk_queue.put(document)
+                            except Exception as e:
+                                logger.warning(
+                                    f"Skipping file {file_path} due to error: {e}"
+                                )
+                finally:
+                    # Sentinel tells the consumer that production is done
+                    chunk_queue.put(None)
+
+            producer = threading.Thread(target=produce, daemon=True)
+            producer.start()
+
+            total_chunks = 0
+            batch: List[Any] = []
+            while True:
+                document = chunk_queue.get()
+                if document is None:
+                    break
+                batch.append(document)
+                if len(batch) >= INGEST_BATCH_SIZE:
+                    self.supabase_manager.add_documents(batch)
+                    total_chunks += len(batch)
+                    batch = []
+
+            if batch:
+                self.supabase_manager.add_documents(batch)
+                total_chunks += len(batch)
+
+            producer.join()
+
+            if not total_chunks:
+                logger.warning("No documents were processed")
+                return False
+
+            # Cached answers may predate the new content
+            self.semantic_cache.clear()
+
+            logger.info(
+                f"Successfully added {total_chunks} document chunks from {len(file_paths)} files"
+            )
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to add documents: {e}")
+            return False
+
+    async def aadd_documents_from_files(self, file_paths: List[str]) -> bool:
+        """Async variant of add_documents_from_files with concurrent file reads"""
+        try:
+            documents = await self.embedding_manager.aprocess_multiple_files(
+                file_paths
+            )
+
+            if not documents:
+                logger.warning("No documents were processed")
+                return False
+
+            await self.supabase_manager.aadd_documents(documents)
+
+            # Cached answers may predate the new content
+            self.semantic_cache.clear()
+
+            logger.info(
+                f"Successfully added {len(documents)} document chunks from {len(file_paths)} files"
+            )
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to add documents: {e}")
+            return False
+
+    def add_text_documents(
+        self,
+        texts: List[str],
+        metadatas: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ) -> bool:
+        """Add multiple text documents to the knowledge base in one batch"""
+        try:
+            if metadatas is None:
+                metadatas = [None] * len(texts)
+
+            # Split all texts into chunks first so embedding and insert
+            # happen as a single batch instead of one round trip per text
+            documents = []
+            for text, metadata in zip(texts, metadatas):
+                documents.extend(
+                    self.embedding_manager.split_text_into_chunks(text, metadata)
+                )
+
+            if not documents:
+                logger.warning("No documents were processed")
+                return False
+
+            self.supabase_manager.add_documents(documents)
+
+            # Cached answers may predate the new content
+            self.semantic_cache.clear()
+
+            logger.info(
+                f"Successfully added {len(texts)} text documents with {len(documents)} chunks"
+            )
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to add text documents: {e}")
+            return False
+
+    async def aadd_text_documents(
+        self,
+        texts: List[str],
+        metadatas: Optional[List[Optional[Dict[str, Any]]]] = None,
+    ) -> bool:
+        """Async variant of add_text_documents with concurrent embedding"""
+        try:
+            if metadatas is None:
+                metadatas = [None] * len(texts)
+
+            documents = []
+            for text, metadata in zip(texts, metadatas):
+                documents.extend(
+                    self.embedding_manager.split_text_into_chunks(text, metadata)
+                )
+
+            if not documents:
+                logger.warning("No documents were processed")
+                return False
+
+            await self.supabase_manager.aadd_documents(documents)
+
+            # Cached answers may predate the new content
+            self.semantic_cache.clear()
+
+            logger.info(
+                f"Successfully added {len(texts)} text documents with {len(documents)} chunks"
+            )
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to add text documents: {e}")
+            return False
+
+    async def aadd_text_document(
+        self, text: str, metadata: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """Async variant of add_text_document"""
+        return await self.aadd_text_documents([text], [metadata])
+
+    def add_text_document(
+        self, text: str, metadata: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """Add a text document to the knowledge base"""
+        try:
+            # Process text into chunks
+            documents = self.embedding_manager.split_text_into_chunks(text, metadata)
+
+            # Add to vector store
+            self.supabase_manager.add_documents(documents)
+
+            # Cached answers may predate the new content
+            self.semantic_cache.clear()
+
+            logger.info(
+                f"Successfully added text document with {len(documents)} chunks"
+            )
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to add text document: {e}")
+            return False
@@ -2,9 +2,14 @@
 Streamlit web-käyttöliittymä RAG-järjestelmälle
 """
 
+import hashlib
 import logging
 import os
+import shutil
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import streamlit as st
 from dotenv import load_dotenv
 
@@ -15,12 +20,22 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Import RAG system
-try:
-    from src.rag.rag_system import RAGSystem
-except ImportError as e:
-    st.error(f"Virhe RAG-järjestelmän tuonnissa: {e}")
-    st.stop()
+# Environment variables the RAG system needs before it can start
+REQUIRED_ENV_VARS = ("OPENAI_API_KEY", "SUPABASE_URL", "SUPABASE_KEY")
+
+# Session-level answer cache bounds
+ASK_CACHE_SIZE = 128
+ASK_CACHE_THRESHOLD = 0.95
+
+# Default HNSW candidate-list size; matches the match_documents default
+DEFAULT_EF_SEARCH = 40
+
+# Chat history bounds: total kept in memory and how many render inline
+CHAT_HISTORY_SIZE = 100
+CHAT_HISTORY_INLINE = 20
+
+# Uploads under this size are ingested straight from memory, no temp file
+SMALL_UPLOAD_LIMIT = 8 * 1024 * 1024
 
 # Page configuration
 st.set_page_config(
@@ -30,9 +45,8 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# Custom CSS
-st.markdown(
-    """
+# Static markup hoisted to module scope so reruns reuse the same strings
+CUSTOM_CSS = """
 <style>
     .main-header {
         text-align: center;
@@ -61,9 +75,20 @@ st.markdown(
         border-radius: 10px;
     }
 </style>
-""",
-    unsafe_allow_html=True,
-)
+"""
+
+MAIN_HEADER_HTML = """
+<div class="main-header">
+    <h1>🤖 RAG Chat-järjestelmä</h1>
+    <p>Kysele tietoja tietokannasta käyttäen OpenAI embeddingsiä ja Supabase vektoritietokantaa</p>
+</div>
+"""
+
+SIDEBAR_HEADER_HTML = """
+<div class="sidebar-content">
+    <h3>🔧 Asetukset</h3>
+</div>
+"""
 
 
 @st.cache_resource
@@ -71,8 +96,7 @@ def initialize_rag_system():
     """Initialize RAG system with caching"""
     try:
         # Check environment variables
-        required_vars = ["OPENAI_API_KEY", "SUPABASE_URL", "SUPABASE_KEY"]
-        missing_vars = [var for var in required_vars if not os.getenv(var)]
+        missing_vars = [var for var in REQUIRED_ENV_VARS if not os.environ.get(var)]
 
         if missing_vars:
             st.error(f"❌ Puuttuvat ympäristömuuttujat: {', '.join(missing_vars)}")
@@ -81,6 +105,10 @@ def initialize_rag_system():
             )
             return None
 
+        # Import lazily so a missing-env-var exit doesn't pay for
+        # loading openai/langchain/supabase
+        from src.rag.rag_system import RAGSystem
+
         # Initialize RAG system
         rag_system = RAGSystem()
         return rag_system
@@ -90,6 +118,109 @@ def initialize_rag_system():
         return None
 
 
+@st.cache_data(ttl=30, show_spinner=False)
+def _system_healthy() -> bool:
+    """Check database reachability with a minimal query, memoized for 30 s
+
+    Kept deliberately cheap (one-row select, no embeddings or LLM) since
+    Streamlit reruns the whole script on every widget interaction.
+    """
+    try:
+        rag_system = initialize_rag_system()
+        if rag_system is None:
+            return False
+        rag_system.supabase_manager.client.table("documents").select("id").limit(
+            1
+        ).execute()
+        return True
+    except Exception as e:
+        logger.warning(f"Health check failed: {e}")
+        return False
+
+
+def _ask_cache_key(prompt: str, ef_search) -> str:
+    """Exact-match cache key from the normalized prompt and search tuning"""
+    normalized = f"{prompt.strip().lower()}:{ef_search}".encode("utf-8")
+    return hashlib.blake2b(normalized, digest_size=16).hexdigest()
+
+
+def _init_ask_cache():
+    """Create the per-session answer cache structures on first use"""
+    if "ask_cache" not in st.session_state:
+        st.session_state.ask_cache = OrderedDict()
+        st.session_state.ask_cache_vectors = []
+
+
+def _clear_ask_cache():
+    """Drop cached answers, e.g. after new documents are ingested"""
+    _init_ask_cache()
+    st.session_state.ask_cache.clear()
+    st.session_state.ask_cache_vectors = []
+
+
+def _ask_cache_lookup(rag_system, prompt, ef_search=None):
+    """Look up a question in the two-tier session cache
+
+    Exact repeats are served from a hash lookup; near-identical questions
+    from an embedding-similarity match. Both skip the Supabase search and
+    the LLM call entirely, and a repeated exact question skips even the
+    embedding request. Entries are keyed on ef_search too, so answers
+    fetched at different recall settings never mix.
+
+    Returns (result, query_embedding, key); result is None on a miss, and
+    the embedding and key let the caller store a fresh answer afterwards.
+    """
+    _init_ask_cache()
+    cache = st.session_state.ask_cache
+
+    key = _ask_cache_key(prompt, ef_search)
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key], None, key
+
+    # Semantic tier: accept a close-enough earlier question
+    query_embedding = np.asarray(
+        rag_system.supabase_manager.embed_query(prompt), dtype=np.float32
+    )
+    norm = np.linalg.norm(query_embedding)
+    if norm > 0:
+        query_embedding = query_embedding / norm
+    for vector, cached_key, cached_ef in st.session_state.ask_cache_vectors:
+        if (
+            cached_ef == ef_search
+            and cached_key in cache
+            and float(vector @ query_embedding) >= ASK_CACHE_THRESHOLD
+        ):
+            return cache[cached_key], query_embedding, key
+
+    return None, query_embedding, key
+
+
+def _ask_cache_store(key, query_embedding, ef_search, result):
+    """Store a fresh answer in the session cache with LRU eviction"""
+    _init_ask_cache()
+    cache = st.session_state.ask_cache
+
+    cache[key] = result
+    if query_embedding is not None:
+        st.session_state.ask_cache_vectors.append((query_embedding, key, ef_search))
+    while len(cache) > ASK_CACHE_SIZE:
+        old_key, _ = cache.popitem(last=False)
+        st.session_state.ask_cache_vectors = [
+            (vector, k, ef)
+            for vector, k, ef in st.session_state.ask_cache_vectors
+            if k != old_key
+        ]
+
+
+def _ingest_file_path(rag_system, temp_path):
+    """Background ingest worker for a temp file; cleans up when done"""
+    try:
+        return rag_system.add_documents_from_files([temp_path])
+    finally:
+        os.remove(temp_path)
+
+
 def add_sample_data(rag_system):
     """Add sample data to the system"""
     sample_texts = [
@@ -122,25 +253,24 @@ def add_sample_data(rag_system):
         },
     ]
 
-    success_count = 0
-    for item in sample_texts:
-        if rag_system.add_text_document(item["text"], item["metadata"]):
-            success_count += 1
+    # One batched call: all texts go to the embeddings API and Supabase
+    # together instead of one round trip per sample document
+    texts = [item["text"] for item in sample_texts]
+    metadatas = [item["metadata"] for item in sample_texts]
 
-    return success_count
+    if rag_system.add_text_documents(texts, metadatas):
+        return len(sample_texts)
+    return 0
 
 
 def main():
+    # Emit on every run: Streamlit drops elements a rerun doesn't
+    # re-emit, so a once-per-session style block would vanish on the
+    # first interaction
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+
     # Header
-    st.markdown(
-        """
-    <div class="main-header">
-        <h1>🤖 RAG Chat-järjestelmä</h1>
-        <p>Kysele tietoja tietokannasta käyttäen OpenAI embeddingsiä ja Supabase vektoritietokantaa</p>
-    </div>
-    """,
-        unsafe_allow_html=True,
-    )
+    st.markdown(MAIN_HEADER_HTML, unsafe_allow_html=True)
 
     # Initialize RAG system
     rag_system = initialize_rag_system()
@@ -152,20 +282,25 @@ def main():
         return
 
     # Sidebar
-    st.sidebar.markdown(
-        """
-    <div class="sidebar-content">
-        <h3>🔧 Asetukset</h3>
-    </div>
-    """,
-        unsafe_allow_html=True,
+    st.sidebar.markdown(SIDEBAR_HEADER_HTML, unsafe_allow_html=True)
+
+    # HNSW recall/latency knob; the server default is used until changed
+    ef_search_value = st.sidebar.slider(
+        "🎯 Haun tarkkuus (ef_search)",
+        min_value=10,
+        max_value=200,
+        value=DEFAULT_EF_SEARCH,
+        step=10,
+        help="Suurempi arvo parantaa hakutarkkuutta, pienempi nopeuttaa hakua",
     )
+    ef_search = None if ef_search_value == DEFAULT_EF_SEARCH else ef_search_value
 
     # Add sample data button
     if st.sidebar.button("📚 Lisää esimerkkitiedot"):
         with st.spinner("Lisätään esimerkkitietoja..."):
             count = add_sample_data(rag_system)
             if count > 0:
+                _clear_ask_cache()
                 st.sidebar.success(f"✅ Lisättiin {count} dokumenttia!")
             else:
                 st.sidebar.error("❌ Dokumenttien lisäys epäonnistui")
@@ -178,30 +313,62 @@ def main():
         help="Voit ladata .txt tiedostoja tietokantaan",
     )
 
+    # Background pool so ingest jobs don't freeze the UI; embedding and
+    # inserts are I/O-bound, so worker threads release the GIL while the
+    # chat input stays responsive
+    executor = st.session_state.setdefault(
+        "ingest_pool", ThreadPoolExecutor(max_workers=2)
+    )
+    if "ingest_futures" not in st.session_state:
+        st.session_state.ingest_futures = []
+
     if uploaded_file and st.sidebar.button("📤 Lataa tiedosto"):
         try:
-            # Save uploaded file temporarily
-            temp_path = f"temp/{uploaded_file.name}"
-            os.makedirs("temp", exist_ok=True)
-
-            with open(temp_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-
-            # Add to RAG system
-            with st.spinner("Käsitellään tiedostoa..."):
-                success = rag_system.add_documents_from_files([temp_path])
-
-            if success:
-                st.sidebar.success(f"✅ Tiedosto {uploaded_file.name} lisätty!")
+            if uploaded_file.size < SMALL_UPLOAD_LIMIT:
+                # The upload already sits in memory, so feed it straight
+                # to the splitter without a disk round trip
+                text = uploaded_file.getvalue().decode("utf-8", errors="replace")
+                future = executor.submit(
+                    rag_system.add_text_document,
+                    text,
+                    {"source": uploaded_file.name},
+                )
             else:
-                st.sidebar.error("❌ Tiedoston lisääminen epäonnistui")
-
-            # Clean up temp file
-            os.remove(temp_path)
+                # Large files stream to a temp file in 1 MiB chunks
+                # instead of materializing the whole upload at once
+                temp_path = f"temp/{uploaded_file.name}"
+                os.makedirs("temp", exist_ok=True)
+                uploaded_file.seek(0)
+                with open(temp_path, "wb") as f:
+                    shutil.copyfileobj(uploaded_file, f, length=1 << 20)
+                future = executor.submit(_ingest_file_path, rag_system, temp_path)
+
+            st.session_state.ingest_futures.append((uploaded_file.name, future))
+            st.sidebar.info(
+                f"⏳ Tiedosto {uploaded_file.name} käsitellään taustalla"
+            )
 
         except Exception as e:
             st.sidebar.error(f"Virhe tiedoston käsittelyssä: {e}")
 
+    # Report finished background ingests and keep pending ones listed
+    if st.session_state.ingest_futures:
+        pending = []
+        for file_name, future in st.session_state.ingest_futures:
+            if not future.done():
+                st.sidebar.info(f"⏳ {file_name} käsitellään...")
+                pending.append((file_name, future))
+                continue
+            try:
+                if future.result():
+                    _clear_ask_cache()
+                    st.sidebar.success(f"✅ Tiedosto {file_name} lisätty!")
+                else:
+                    st.sidebar.error(f"❌ Tiedoston {file_name} lisäys epäonnistui")
+            except Exception as e:
+                st.sidebar.error(f"Virhe tiedoston käsittelyssä: {e}")
+        st.session_state.ingest_futures = pending
+
     # Add text directly
     st.sidebar.markdown("### ✍️ Lisää tekstiä suoraan")
     with st.sidebar.expander("Lisää uusi dokumentti"):
@@ -218,6 +385,7 @@ def main():
                     metadata["category"] = doc_category
 
                 if rag_system.add_text_document(doc_text, metadata):
+                    _clear_ask_cache()
                     st.success("✅ Dokumentti lisätty!")
                 else:
                     st.error("❌ Dokumentin lisäys epäonnistui")
@@ -230,12 +398,24 @@ def main():
     with col1:
         st.markdown("### 💬 Keskustelu")
 
-        # Initialize chat history
+        # Initialize chat history; deque drops the oldest messages so a
+        # long session can't grow memory or rerun render cost unbounded
         if "messages" not in st.session_state:
-            st.session_state.messages = []
-
-        # Display chat messages
-        for message in st.session_state.messages:
+            st.session_state.messages = deque(maxlen=CHAT_HISTORY_SIZE)
+
+        # Display chat messages: recent ones inline, the rest collapsed
+        # so reruns don't re-render the whole history
+        messages = list(st.session_state.messages)
+        older, recent = (
+            messages[:-CHAT_HISTORY_INLINE],
+            messages[-CHAT_HISTORY_INLINE:],
+        )
+        if older:
+            with st.expander(f"Aiemmat viestit ({len(older)})"):
+                for message in older:
+                    with st.chat_message(message["role"]):
+                        st.markdown(message["content"])
+        for message in recent:
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
 
@@ -250,27 +430,67 @@ def main():
 
             # Get response from RAG system
             with st.chat_message("assistant"):
-                with st.spinner("Mietin vastausta..."):
-                    try:
-                        result = rag_system.ask(prompt, thread_id="streamlit_session")
-                        response = result["answer"]
-
+                try:
+                    cached, query_embedding, cache_key = _ask_cache_lookup(
+                        rag_system, prompt, ef_search
+                    )
+                    if cached is not None:
+                        response = cached["answer"]
+                        retrieved_docs = cached["retrieved_docs"]
                         st.markdown(response)
-
-                        # Store assistant response
-                        st.session_state.messages.append(
-                            {"role": "assistant", "content": response}
-                        )
-
-                        # Store retrieved docs in session state for sidebar
-                        st.session_state.last_retrieved_docs = result["retrieved_docs"]
-
-                    except Exception as e:
-                        error_msg = f"Virhe vastausta generoitaessa: {e}"
-                        st.error(error_msg)
-                        st.session_state.messages.append(
-                            {"role": "assistant", "content": error_msg}
+                    else:
+                        from src.rag.rag_system import ERROR_ANSWER
+
+                        # Stream tokens as they arrive; the retrieved
+                        # documents come back through the side channel
+                        retrieved_docs = []
+                        response = st.write_stream(
+                            rag_system.ask_stream(
+                                prompt,
+                                thread_id="streamlit_session",
+                                ef_search=ef_search,
+                                on_retrieved=retrieved_docs.extend,
+                            )
                         )
+                        # Don't cache failures: a stream that errored out
+                        # (fully or mid-generation) ends with the canned
+                        # apology, and caching it would pin a transient
+                        # outage to this prompt and its paraphrases
+                        if ERROR_ANSWER not in response:
+                            _ask_cache_store(
+                                cache_key,
+                                query_embedding,
+                                ef_search,
+                                {
+                                    "query": prompt,
+                                    "answer": response,
+                                    "retrieved_docs": retrieved_docs,
+                                    "context": "",
+                                },
+                            )
+
+                    # Store assistant response
+                    st.session_state.messages.append(
+                        {"role": "assistant", "content": response}
+                    )
+
+                    # Store lightweight previews instead of Document
+                    # objects: the slicing happens once per answer,
+                    # and the originals can be garbage collected
+                    st.session_state.last_retrieved_docs = [
+                        {
+                            "preview": doc.page_content[:200] + "...",
+                            "meta": doc.metadata,
+                        }
+                        for doc in retrieved_docs
+                    ]
+
+                except Exception as e:
+                    error_msg = f"Virhe vastausta generoitaessa: {e}"
+                    st.error(error_msg)
+                    st.session_state.messages.append(
+                        {"role": "assistant", "content": error_msg}
+                    )
 
     with col2:
         st.markdown("### ℹ️ Tietoja")
@@ -287,30 +507,25 @@ def main():
         """)
 
         # Show retrieved documents if any
-        if (
-            hasattr(st.session_state, "last_retrieved_docs")
-            and st.session_state.last_retrieved_docs
-        ):
+        if st.session_state.get("last_retrieved_docs"):
             st.markdown("### 📖 Löydetyt dokumentit")
             for i, doc in enumerate(st.session_state.last_retrieved_docs, 1):
                 with st.expander(f"Dokumentti {i}"):
-                    st.write(doc.page_content[:200] + "...")
-                    if doc.metadata:
-                        st.json(doc.metadata)
+                    st.write(doc["preview"])
+                    if doc["meta"]:
+                        st.json(doc["meta"])
 
         # Clear chat button
         if st.button("🗑️ Tyhjennä keskustelu"):
-            st.session_state.messages = []
-            if hasattr(st.session_state, "last_retrieved_docs"):
-                del st.session_state.last_retrieved_docs
+            st.session_state.messages = deque(maxlen=CHAT_HISTORY_SIZE)
+            st.session_state.pop("last_retrieved_docs", None)
             st.rerun()
 
         # Show system status
         st.markdown("### 🔧 Järjestelmän tila")
-        try:
-            # Simple status check
+        if _system_healthy():
             st.success("🟢 Järjestelmä toimii")
-        except Exception:
+        else:
             st.error("🔴 Järjestelmässä on ongelma")
 
 